@@ -5,44 +5,133 @@ beliefs, values, lifestyle, and background through an interactive questionnaire.
 """
 # cSpell:ignore jsonify werkzeug dotenv puja moksha sikhism jainism shintoism paganism wicca
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
-import json
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
+from flask_session import Session
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+import atexit
+import functools
+import hashlib
+import hmac
+import orjson
 import os
+import queue
 import re
 import secrets
+import sqlite3
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from dotenv import load_dotenv
-from together import Together
+import httpx
+import numpy as np
 from rag_utils import load_religions_from_csv, prepare_religion_rag_context
-from openai import OpenAI
+import redis
+from cachetools import TTLCache
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
 
 load_dotenv()
 
+# Environment is read once at import; request handlers only use these constants
+FLASK_ENV = os.getenv('FLASK_ENV')
+ENVIRONMENT = os.getenv('ENVIRONMENT', 'unknown')
+ENABLE_DEBUG_ROUTES = os.getenv('ENABLE_DEBUG_ROUTES') == '1'
+REDIS_URL = os.getenv("REDIS_URL")
+SECRET_KEY = os.getenv('SECRET_KEY')
+
+# REDIS_URL fans out to several gunicorn workers; sessions and account tokens
+# are signed with the secret key, so every worker must share the same one
+if REDIS_URL and not SECRET_KEY:
+    raise RuntimeError("SECRET_KEY must be set when REDIS_URL is set (multiple workers need a shared signing key)")
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson for faster request/response (de)serialization"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, MappingProxyType):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(32))
+app.json = ORJSONProvider(app)
+app.secret_key = SECRET_KEY or secrets.token_hex(32)
 
 # Session configuration for production deployment
-app.config['SESSION_COOKIE_SECURE'] = os.getenv('FLASK_ENV') == 'production'
+app.config['SESSION_COOKIE_SECURE'] = FLASK_ENV == 'production'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
 
-# Initialize Firebase Admin SDK
-try:
-    firebase_cred_path = os.getenv('FIREBASE_CREDENTIALS_PATH', 'serviceAccountKey.json')
-    if os.path.exists(firebase_cred_path):
-        cred = credentials.Certificate(firebase_cred_path)
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        print("✅ Firebase initialized successfully")
-    else:
-        print(f"⚠️ Firebase credentials not found at {firebase_cred_path}")
-        db = None
-except Exception as e:
-    print(f"⚠️ Firebase initialization failed: {e}")
-    db = None
+# Reject oversized bodies before they are buffered (Whisper's upload limit is 25 MB)
+app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024
+
+@functools.lru_cache(maxsize=128)
+def error_body(message):
+    """Serialized failure payload, encoded once per distinct message"""
+    return orjson.dumps({"success": False, "message": message})
+
+def error_response(message, status=200):
+    """Fresh JSON response carrying a cached {"success": false, "message": ...} body"""
+    return app.response_class(error_body(message), status=status, mimetype='application/json')
+
+def lazy_singleton(factory):
+    """Build the value on first call and return the same object afterwards (thread-safe)"""
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def getter():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+    return getter
+
+# Under gevent workers (wsgi.py patches threading before importing the app), long
+# C calls such as password hashing would stall every greenlet in the worker, so
+# they run on gevent's native thread pool instead
+GEVENT_PATCHED = 'gevent.monkey' in sys.modules and sys.modules['gevent.monkey'].is_module_patched('threading')
+
+def run_off_hub(func, *args):
+    """Call func(*args), on gevent's native thread pool when running under gevent"""
+    if GEVENT_PATCHED:
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+# Firebase Admin SDK is initialized on first use, not at import
+FIREBASE_CRED_PATH = os.getenv('FIREBASE_CREDENTIALS_PATH', 'serviceAccountKey.json')
+
+@lazy_singleton
+def get_db():
+    """Initialize Firebase Admin SDK and return the Firestore client (None if unavailable)"""
+    try:
+        if os.path.exists(FIREBASE_CRED_PATH):
+            cred = credentials.Certificate(FIREBASE_CRED_PATH)
+            firebase_admin.initialize_app(cred)
+            db = firestore.client()
+            print("✅ Firebase initialized successfully")
+            return db
+        print(f"⚠️ Firebase credentials not found at {FIREBASE_CRED_PATH}")
+    except Exception as e:
+        print(f"⚠️ Firebase initialization failed: {e}")
+    return None
 
 # Firebase Web Config (for frontend)
 FIREBASE_CONFIG = {
@@ -54,17 +143,72 @@ FIREBASE_CONFIG = {
     'appId': os.getenv('FIREBASE_APP_ID')
 }
 
-# File to store user data - defaults to current directory (writable in Docker)
+# SQLite database for legacy user data - defaults to current directory (writable in Docker)
 # Keep for backward compatibility during transition
+USERS_DB = os.getenv("USERS_DB", "users.db")
+# Older JSON users file, imported into USERS_DB the first time the database is empty
 USERS_FILE = os.getenv("USERS_FILE", "users_data.json")
 
-# Together API for chatbot
+# Legacy username/password accounts are opt-in once Firebase is configured, so
+# production never opens USERS_DB (set ENABLE_LEGACY_USERS=true to keep them)
+LEGACY_USERS_ENABLED = os.getenv(
+    "ENABLE_LEGACY_USERS", "false" if os.path.exists(FIREBASE_CRED_PATH) else "true"
+).lower() == "true"
+LEGACY_DISABLED_MESSAGE = "Username/password accounts are disabled. Please sign in with Firebase."
+
+# Keep-alive HTTP/2 connection pools so concurrent LLM calls reuse TLS sessions;
+# idle connections stay open for a minute instead of httpx's 5s default
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60)
+
+# Chat runs on the request thread, so cap each call well under the worker timeout
+CHAT_HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+# Together API for chatbot (client created on first chat)
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
-client = Together(api_key=TOGETHER_API_KEY) if TOGETHER_API_KEY else None
 
-# OpenAI for Whisper transcription
+@lazy_singleton
+def get_chat_client():
+    """Together client for the chatbot, or None if TOGETHER_API_KEY is not set"""
+    if not TOGETHER_API_KEY:
+        return None
+    # The SDK is imported here so workers that never chat don't load it
+    import together
+    return together.Together(
+        api_key=TOGETHER_API_KEY,
+        timeout=CHAT_HTTP_TIMEOUT,
+        http_client=together.DefaultHttpxClient(http2=True, limits=HTTP_POOL_LIMITS)
+    )
+
+# OpenAI for Whisper transcription (client created on first transcription)
+# The SDK retries 429/5xx responses itself with exponential backoff
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+
+@lazy_singleton
+def get_openai_client():
+    """OpenAI client for Whisper, or None if OPENAI_API_KEY is not set"""
+    if not OPENAI_API_KEY:
+        return None
+    import openai
+    return openai.OpenAI(
+        api_key=OPENAI_API_KEY,
+        max_retries=3,
+        http_client=openai.DefaultHttpxClient(http2=True, limits=HTTP_POOL_LIMITS)
+    )
+
+# Whisper calls run on a background pool so web threads never wait on OpenAI;
+# the pool size caps in-flight transcriptions per worker
+WHISPER_MAX_CONCURRENT = int(os.getenv("WHISPER_MAX_CONCURRENT", "8"))
+transcription_executor = ThreadPoolExecutor(max_workers=WHISPER_MAX_CONCURRENT, thread_name_prefix="whisper")
+
+# Redis for state shared across workers (sessions, transcription jobs)
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Server-side sessions: the cookie only carries a session id and the payload
+# lives in Redis. Without Redis, Flask's signed-cookie sessions are used.
+if redis_client:
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis_client
+    Session(app)
 
 # Load detailed religion data at startup
 RELIGIONS_CSV = load_religions_from_csv('religions.csv')
@@ -86,6 +230,17 @@ def canon(key):
     """Normalize tradition key to canonical form"""
     return TRADITION_ALIASES.get(key, key)
 
+def freeze(value):
+    """Recursively convert dicts/lists to read-only mappings/tuples with interned keys"""
+    if isinstance(value, dict):
+        return MappingProxyType({
+            sys.intern(k) if isinstance(k, str) else k: freeze(v)
+            for k, v in value.items()
+        })
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
 # Question importance weights (higher = more significant)
 QUESTION_WEIGHTS = {
     1: 5,  # Nature of the divine (most fundamental)
@@ -300,6 +455,7 @@ QUESTIONS = [
         }
     }
 ]
+QUESTIONS = freeze(QUESTIONS)
 
 # Religion Descriptions
 RELIGIONS = {
@@ -322,33 +478,115 @@ RELIGIONS = {
     "stoicism": {"name": "Stoicism", "description": "Philosophy emphasizing virtue, reason, and acceptance of fate.", "practices": "Contemplation, virtue practice, rational thinking", "core_beliefs": "Virtue, reason, acceptance, inner peace"},
     "confucianism": {"name": "Confucianism", "description": "Philosophy emphasizing moral cultivation and social harmony.", "practices": "Ritual propriety, study, self-cultivation", "core_beliefs": "Filial piety, benevolence, social harmony"}
 }
+RELIGIONS = freeze(RELIGIONS)
+
+# Scoring tables precomputed from QUESTIONS: one row per (question id, option)
+# and one column per tradition in RELIGIONS, holding the weighted points
+RELIGION_KEYS = tuple(RELIGIONS)
+RELIGION_IDX = {key: i for i, key in enumerate(RELIGION_KEYS)}
+
+# Display fields as parallel tuples indexed by the same column, so results are
+# assembled straight from the ranked column numbers
+RELIGION_NAMES = tuple(RELIGIONS[key]["name"] for key in RELIGION_KEYS)
+RELIGION_DESCRIPTIONS = tuple(RELIGIONS[key]["description"] for key in RELIGION_KEYS)
+RELIGION_PRACTICES = tuple(RELIGIONS[key]["practices"] for key in RELIGION_KEYS)
+RELIGION_CORE_BELIEFS = tuple(RELIGIONS[key]["core_beliefs"] for key in RELIGION_KEYS)
+
+# Number of recommendations returned, and a per-column key that ranks earlier
+# RELIGIONS entries first when score and coverage tie
+TOP_RESULTS = 3
+RELIGION_ORDER_KEY = np.arange(len(RELIGION_KEYS) - 1, -1, -1, dtype=np.int64)
+
+def build_score_matrix():
+    """Build OPTION_INDEX, the weighted SCORE_MATRIX and the COVERAGE_MATRIX tie-breaker"""
+    option_index = {}
+    score_rows = []
+    coverage_rows = []
+    for question in QUESTIONS:
+        question_weight = QUESTION_WEIGHTS.get(question["id"], 1)
+        for option_text, points_map in question["options"].items():
+            score_row = np.zeros(len(RELIGION_KEYS), dtype=np.int16)
+            coverage_row = np.zeros(len(RELIGION_KEYS), dtype=np.int16)
+            for tradition_key, base_points in points_map.items():
+                col = RELIGION_IDX.get(canon(tradition_key))
+                if col is not None:
+                    score_row[col] += base_points * question_weight
+                    coverage_row[col] = 1
+            option_index[(question["id"], option_text)] = len(score_rows)
+            score_rows.append(score_row)
+            coverage_rows.append(coverage_row)
+    return option_index, np.vstack(score_rows), np.vstack(coverage_rows)
+
+OPTION_INDEX, SCORE_MATRIX, COVERAGE_MATRIX = build_score_matrix()
+
+# Scores and coverage side by side so one gather + sum yields both per submission
+SCORE_COVERAGE_MATRIX = np.ascontiguousarray(np.hstack((SCORE_MATRIX, COVERAGE_MATRIX)))
+
+# Highest weighted points any option of a question can award each tradition,
+# one row per question id (per-tradition percentage denominators)
+QUESTION_ROW = {q["id"]: i for i, q in enumerate(QUESTIONS)}
+QUESTION_MAX_MATRIX = np.vstack([
+    SCORE_MATRIX[[OPTION_INDEX[(q["id"], option_text)] for option_text in q["options"]]].max(axis=0)
+    for q in QUESTIONS
+])
 
 
 # ============================================================================
 # FIRESTORE HELPER FUNCTIONS
 # ============================================================================
 
-def get_user_by_uid(uid):
-    """Get user data from Firestore by Firebase UID"""
+# Short-lived cache of Firestore reads: {uid: {field_paths: fields or None}}.
+# Entries for a uid are dropped whenever this process writes that user, which only
+# keeps reads fresh with a single worker, so the cache is off when Redis lets
+# gunicorn run several workers (one worker's write can't clear another's cache)
+USER_CACHE_ENABLED = redis_client is None
+_user_doc_cache = TTLCache(maxsize=10000, ttl=15)
+_user_doc_cache_lock = threading.Lock()
+
+def invalidate_user_cache(uid):
+    """Forget cached Firestore reads for uid after writing to it"""
+    with _user_doc_cache_lock:
+        _user_doc_cache.pop(uid, None)
+
+def get_user_fields(uid, field_paths):
+    """Get only the requested fields of a user document from Firestore"""
+    db = get_db()
     if not db:
         return None
+    
+    key = tuple(field_paths)
+    if USER_CACHE_ENABLED:
+        with _user_doc_cache_lock:
+            cached = _user_doc_cache.get(uid, {})
+            if key in cached:
+                return cached[key]
+    
     try:
         user_ref = db.collection('users').document(uid)
-        user_doc = user_ref.get()
-        if user_doc.exists:
-            return user_doc.to_dict()
-        return None
+        user_doc = user_ref.get(field_paths=field_paths)
+        user_data = (user_doc.to_dict() or {}) if user_doc.exists else None
     except Exception as e:
         print(f"Error getting user {uid}: {e}")
         return None
+    
+    if USER_CACHE_ENABLED:
+        with _user_doc_cache_lock:
+            _user_doc_cache.setdefault(uid, {})[key] = user_data
+    return user_data
+
+def get_user_results(uid):
+    """Get saved assessment results for a Firebase user"""
+    return (get_user_fields(uid, ['results']) or {}).get('results', [])
 
 def create_or_update_user(uid, user_data):
     """Create or update user in Firestore"""
+    db = get_db()
     if not db:
         return False
     try:
         user_ref = db.collection('users').document(uid)
         user_ref.set(user_data, merge=True)
+        invalidate_user_cache(uid)
         return True
     except Exception as e:
         print(f"Error saving user {uid}: {e}")
@@ -356,155 +594,457 @@ def create_or_update_user(uid, user_data):
 
 
 
+# Decoded ID tokens are reused until shortly before they expire (at most 5 minutes),
+# so repeat logins with the same token skip signature verification and key fetches
+_verified_tokens = TTLCache(maxsize=10000, ttl=300)
+_verified_tokens_lock = threading.Lock()
+TOKEN_EXPIRY_MARGIN_SECONDS = 30
+
 def verify_firebase_token(id_token):
     """Verify Firebase ID token and return decoded token"""
+    key = hashlib.blake2b(id_token.encode(), digest_size=16).digest()
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    
     try:
+        get_db()  # make sure the Firebase app is initialized
         decoded_token = auth.verify_id_token(id_token)
-        return decoded_token
     except Exception as e:
         print(f"Token verification error: {e}")
         return None
+    
+    with _verified_tokens_lock:
+        _verified_tokens[key] = (decoded_token.get('exp', 0) - TOKEN_EXPIRY_MARGIN_SECONDS, decoded_token)
+    return decoded_token
 
 # ============================================================================
-# LEGACY JSON FILE FUNCTIONS (for backward compatibility)
+# SHARED STATE STORE (transcription jobs)
 # ============================================================================
 
-def load_users():
+# Entries expire on their own: Redis SETEX keys when configured, otherwise a
+# per-process TTL cache (only valid while a single worker serves all requests)
+STATE_TTL_SECONDS = 3600
+_local_state = TTLCache(maxsize=10000, ttl=STATE_TTL_SECONDS)
+_local_state_lock = threading.Lock()
+
+def state_set(key, data):
+    """Store JSON-serializable data under key with automatic expiry"""
+    if redis_client:
+        redis_client.setex(key, STATE_TTL_SECONDS, orjson.dumps(data))
+    else:
+        with _local_state_lock:
+            _local_state[key] = data
+
+def state_get(key):
+    """Return data stored under key, or None if unknown or expired"""
+    if redis_client:
+        raw = redis_client.get(key)
+        return orjson.loads(raw) if raw else None
+    with _local_state_lock:
+        return _local_state.get(key)
+
+def state_delete(key):
+    """Remove key from the store"""
+    if redis_client:
+        redis_client.delete(key)
+    else:
+        with _local_state_lock:
+            _local_state.pop(key, None)
+
+# ============================================================================
+# ACCOUNT TOKENS (email verification, password reset)
+# ============================================================================
+
+# Tokens are signed with the app secret and carry their own timestamp, so the
+# server keeps no token state and any worker can check them
+TOKEN_MAX_AGE_SECONDS = 3600
+token_serializer = URLSafeTimedSerializer(app.secret_key, salt='account-token')
+
+def make_token(token_data):
+    """Sign token data into a URL-safe token"""
+    return token_serializer.dumps(token_data)
+
+def load_token(token):
+    """Return token data, or None if the token is missing, tampered with or expired"""
+    if not token:
+        return None
     try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-    except Exception as e:
-        print(f"Error loading users: {e}")
-    return {}
+        return token_serializer.loads(token, max_age=TOKEN_MAX_AGE_SECONDS)
+    except (SignatureExpired, BadSignature):
+        return None
+
+# Legacy passwords are hashed with argon2id; older Werkzeug and plaintext
+# entries are still accepted and upgraded on the next successful login
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+
+def hash_password(password):
+    """Hash a password for the legacy users database"""
+    return run_off_hub(password_hasher.hash, password)
+
+def verify_password(stored, password):
+    """Return (matches, needs_rehash) for an argon2, Werkzeug or plaintext stored password"""
+    return run_off_hub(compare_password, stored, password)
+
+def compare_password(stored, password):
+    """Check password against stored; runs on a native thread under gevent"""
+    if stored.startswith('$argon2'):
+        try:
+            password_hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, password_hasher.check_needs_rehash(stored)
+    if stored.startswith(('scrypt:', 'pbkdf2:')):
+        return check_password_hash(stored, password), True
+    return hmac.compare_digest(stored.encode(), password.encode()), True
+
+def password_fingerprint(password_hash):
+    """Short digest of a stored password hash; reset tokens die once the password changes"""
+    return hashlib.blake2b(password_hash.encode(), digest_size=8).hexdigest()
 
-def save_users(users):
-    """Save users to JSON file"""
+# ============================================================================
+# LEGACY USER DATABASE (SQLite, for backward compatibility)
+# ============================================================================
+
+# One row per legacy user: the record is an orjson blob, email is a lowercased
+# indexed column for signup and forgot-password lookups. WAL lets readers in
+# every worker proceed while a single user row is being written.
+_users_db_lock = threading.Lock()
+
+@lazy_singleton
+def get_users_db():
+    """SQLite connection for legacy users, importing USERS_FILE on first use"""
+    os.makedirs(os.path.dirname(USERS_DB) or '.', exist_ok=True)
+    db = sqlite3.connect(USERS_DB, check_same_thread=False, isolation_level=None, timeout=10)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, email TEXT, data BLOB NOT NULL)")
+    db.execute("CREATE INDEX IF NOT EXISTS users_email ON users (email)")
+    import_users_file(db)
+    return db
+
+def import_users_file(db):
+    """Copy users from the old JSON USERS_FILE into an empty database (one-time migration)"""
+    if not os.path.exists(USERS_FILE) or db.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+        return
     try:
-        # Ensure parent directory exists
-        os.makedirs(os.path.dirname(USERS_FILE) if os.path.dirname(USERS_FILE) else '.', exist_ok=True)
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users, f, indent=2)
-        return True
+        with open(USERS_FILE, 'rb') as f:
+            users = orjson.loads(f.read())
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT OR IGNORE INTO users (username, email, data) VALUES (?, ?, ?)",
+                [(username, user_email(user_data), orjson.dumps(user_data)) for username, user_data in users.items()]
+            )
+        print(f"✅ Imported {len(users)} users from {USERS_FILE}")
     except Exception as e:
-        print(f"Error saving users: {e}")
-        return False
+        print(f"⚠️ Error importing users from {USERS_FILE}: {e}")
+
+def user_email(user_data):
+    """Lowercased email for the indexed column, or None"""
+    return (user_data.get('email') or '').lower() or None
+
+def get_legacy_user(username):
+    """Return the legacy user's record, or None if there is no such user"""
+    db = get_users_db()
+    with _users_db_lock:
+        row = db.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+def add_legacy_user(username, user_data):
+    """Insert a new legacy user; False if the username is already taken"""
+    db = get_users_db()
+    with _users_db_lock:
+        cursor = db.execute(
+            "INSERT OR IGNORE INTO users (username, email, data) VALUES (?, ?, ?)",
+            (username, user_email(user_data), orjson.dumps(user_data))
+        )
+    return cursor.rowcount == 1
+
+def update_legacy_user(username, **fields):
+    """Set fields on one legacy user's record in a single transaction; False if not found"""
+    db = get_users_db()
+    with _users_db_lock, db:
+        db.execute("BEGIN IMMEDIATE")
+        row = db.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return False
+        user_data = orjson.loads(row[0])
+        user_data.update(fields)
+        db.execute(
+            "UPDATE users SET email = ?, data = ? WHERE username = ?",
+            (user_email(user_data), orjson.dumps(user_data), username)
+        )
+    return True
+
+def find_username_by_email(email):
+    """Return the legacy username registered with email, or None"""
+    db = get_users_db()
+    with _users_db_lock:
+        row = db.execute(
+            "SELECT username FROM users WHERE email = ? ORDER BY rowid LIMIT 1", (email.lower(),)
+        ).fetchone()
+    return row[0] if row else None
+
+def list_legacy_usernames():
+    """All legacy usernames (debug endpoint only)"""
+    db = get_users_db()
+    with _users_db_lock:
+        return [row[0] for row in db.execute("SELECT username FROM users ORDER BY rowid")]
 
 def initialize_default_user():
     """Create default test user if no users exist"""
-    users = load_users()
-    if not users:  # Only create if no users exist
-        users['test'] = {
-            'password': generate_password_hash('test'),
+    db = get_users_db()
+    with _users_db_lock:
+        has_users = db.execute("SELECT 1 FROM users LIMIT 1").fetchone()
+    if not has_users:  # Only create if no users exist
+        add_legacy_user('test', {
+            'password': hash_password('test'),
             'email': 'test@example.com',
             'verified': True,
             'answers': [],
             'results': []
-        }
-        save_users(users)
+        })
         print("✅ Default test user created (username: test, password: test)")
 
+# ============================================================================
+# USER STORE (one interface over Firestore and legacy users)
+# ============================================================================
+
+class FirestoreStore:
+    """Assessment data for a Firebase user, kept in Firestore"""
+
+    def __init__(self, uid, display_name):
+        self.uid = uid
+        self.display_name = display_name
+        self.user_key = f"firebase:{uid}"
+
+    def load(self):
+        return get_user_results(self.uid)
+
+    def update(self, answers, results):
+        get_db().collection('users').document(self.uid).update({
+            'answers': answers,
+            'results': results,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+        invalidate_user_cache(self.uid)
+        return True
+
+class LegacyStore:
+    """Assessment data for a legacy username/password user, kept in the users database"""
+
+    def __init__(self, username):
+        self.username = username
+        self.display_name = username
+        self.user_key = f"legacy:{username}"
+
+    def load(self):
+        return (get_legacy_user(self.username) or {}).get('results', [])
+
+    def update(self, answers, results):
+        return update_legacy_user(self.username, answers=answers, results=results)
+
+def get_store():
+    """Store for the logged-in user (Firebase first, then legacy), or None if logged out"""
+    user_id = session.get('user_id')
+    if user_id:
+        return FirestoreStore(user_id, session.get('email', 'User'))
+    username = session.get('username') if LEGACY_USERS_ENABLED else None
+    if username:
+        return LegacyStore(username)
+    return None
+
+# With a single worker (no Redis), assessment saves are written by a background
+# thread so submit/reset return as soon as results are computed. A newer save for
+# the same user replaces one still queued, queued results are served to that user's
+# reads until they are written, and a failed write is reported on the next page view.
+# Pending saves live in process memory, so with several workers saves stay synchronous.
+ASYNC_ASSESSMENT_SAVES = redis_client is None
+SAVE_FAILED_MESSAGE = "Your last assessment could not be saved. Please try again."
+_pending_saves = {}
+_failed_saves = set()
+_pending_saves_lock = threading.Lock()
+_save_queue = queue.Queue()
+
+def save_assessment(store, answers, results):
+    """Persist answers and results for the store's user; False if the user is gone"""
+    if not ASYNC_ASSESSMENT_SAVES:
+        return store.update(answers, results)
+    queue_assessment_save(store, answers, results)
+    return True
+
+def queue_assessment_save(store, answers, results):
+    """Schedule store.update(answers, results) on the background saver"""
+    with _pending_saves_lock:
+        already_queued = store.user_key in _pending_saves
+        _pending_saves[store.user_key] = (store, answers, results)
+    if not already_queued:
+        _save_queue.put(store.user_key)
+
+def load_results(store):
+    """Saved results for the store's user, including a save that is still queued"""
+    with _pending_saves_lock:
+        pending = _pending_saves.get(store.user_key)
+    return pending[2] if pending else store.load()
+
+def pop_save_error(store):
+    """Message for a background save of this user's that failed since the last check, or None"""
+    with _pending_saves_lock:
+        if store.user_key in _failed_saves:
+            _failed_saves.discard(store.user_key)
+            return SAVE_FAILED_MESSAGE
+    return None
+
+def write_pending_save(user_key):
+    """Write the newest queued save for user_key"""
+    with _pending_saves_lock:
+        pending = _pending_saves.get(user_key)
+    if pending is None:
+        return
+    store, answers, results = pending
+    try:
+        saved = store.update(answers, results)
+        if not saved:
+            print(f"⚠️ Assessment not saved, user not found: {user_key}")
+    except Exception as e:
+        saved = False
+        print(f"⚠️ Error saving assessment for {user_key}: {e}")
+    with _pending_saves_lock:
+        if saved:
+            _failed_saves.discard(user_key)
+        else:
+            _failed_saves.add(user_key)
+        if _pending_saves.get(user_key) is pending:
+            del _pending_saves[user_key]
+        else:
+            # A newer save arrived while this one was being written
+            _save_queue.put(user_key)
+
+def assessment_saver():
+    """Background thread: write queued assessment saves one at a time, in order"""
+    while True:
+        write_pending_save(_save_queue.get())
+
+def flush_assessment_saves():
+    """Synchronously write every queued save (used at shutdown)"""
+    with _pending_saves_lock:
+        user_keys = list(_pending_saves)
+    for user_key in user_keys:
+        write_pending_save(user_key)
+
+if ASYNC_ASSESSMENT_SAVES:
+    threading.Thread(target=assessment_saver, name="assessment-saver", daemon=True).start()
+    atexit.register(flush_assessment_saves)
+
+def login_required(view):
+    """Reject requests without a logged-in session; the user's store is available as g.store"""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        g.store = get_store()
+        if not g.store:
+            return error_response("Not logged in")
+        return view(*args, **kwargs)
+    return wrapped
+
 def calculate_results(answers):
     """
     Calculate which spiritual paths align with user's answers
     Uses weighted scoring with canonical tradition keys and tie-breakers
     """
-    scores = {}
-    coverage = {}  # Track number of questions contributing to each tradition (for tie-breaking)
+    # Map each answered option to its SCORE_MATRIX row (unknown options are skipped)
+    option_keys = ((answer["question_id"], answer["answer"]) for answer in answers)
+    rows = np.fromiter(
+        (OPTION_INDEX[key] for key in option_keys if key in OPTION_INDEX),
+        dtype=np.intp
+    )
     
-    # Calculate weighted scores
-    for answer in answers:
-        question = next((q for q in QUESTIONS if q["id"] == answer["question_id"]), None)
-        if question and answer["answer"] in question["options"]:
-            points_map = question["options"][answer["answer"]]
-            question_weight = QUESTION_WEIGHTS.get(answer["question_id"], 1)
-            
-            # Track which traditions are scored in this question (for tie-breaker)
-            touched_this_question = set()
-            
-            for tradition_key, base_points in points_map.items():
-                # Normalize tradition key to canonical form
-                canonical_key = canon(tradition_key)
-                
-                # Calculate weighted score
-                weighted_score = base_points * question_weight
-                scores[canonical_key] = scores.get(canonical_key, 0) + weighted_score
-                touched_this_question.add(canonical_key)
-            
-            # Update coverage count for tie-breaking
-            for key in touched_this_question:
-                coverage[key] = coverage.get(key, 0) + 1
+    # Weighted scores, plus number of questions contributing to each tradition (for tie-breaking)
+    totals = SCORE_COVERAGE_MATRIX[rows].sum(axis=0)
+    scores, coverage = totals[:len(RELIGION_KEYS)], totals[len(RELIGION_KEYS):]
     
-    # Calculate maximum possible score for percentage calculation
-    max_possible_score = 0
-    for answer in answers:
-        question = next((q for q in QUESTIONS if q["id"] == answer["question_id"]), None)
-        if question:
-            # Find the highest point value among all options for this question
-            max_option_points = 0
-            for option_scores in question["options"].values():
-                if option_scores:
-                    max_option_points = max(max_option_points, max(option_scores.values()))
-            
-            question_weight = QUESTION_WEIGHTS.get(answer["question_id"], 1)
-            max_possible_score += max_option_points * question_weight
+    # Maximum each tradition could have scored on the answered questions (percentage denominator)
+    question_rows = np.fromiter(
+        (QUESTION_ROW[answer["question_id"]] for answer in answers if answer["question_id"] in QUESTION_ROW),
+        dtype=np.intp
+    )
+    max_scores = QUESTION_MAX_MATRIX[question_rows].sum(axis=0)
+    
+    # Percentage of each tradition's own maximum, rounded like the displayed value
+    percentages = np.rint(
+        np.divide(scores * 100, max_scores, out=np.zeros(len(RELIGION_KEYS)), where=max_scores > 0)
+    ).astype(np.int64)
     
-    # Sort by score (primary) and coverage (tie-breaker)
+    # Rank by percentage (primary), then score, coverage and RELIGIONS order folded into
+    # one unique integer key; each field is bounded by the span it is multiplied past,
+    # so the displayed percentages always follow the ranking
     # Higher coverage means the tradition was scored across more questions
-    sorted_scores = sorted(
-        scores.items(),
-        key=lambda x: (x[1], coverage.get(x[0], 0)),
-        reverse=True
-    )
+    score_span = int(max_scores.max(initial=0)) + 1
+    rank_key = ((percentages * score_span + scores) * (len(rows) + 1) + coverage) * len(RELIGION_KEYS) + RELIGION_ORDER_KEY
+    rank_key[coverage == 0] = np.iinfo(rank_key.dtype).min
+    
+    # Partial selection of the top 3 columns, then order just those, skipping untouched traditions
+    top = np.argpartition(rank_key, -TOP_RESULTS)[-TOP_RESULTS:]
+    ranked = [col for col in top[np.argsort(rank_key[top])[::-1]] if coverage[col] > 0]
     
     # Build top 3 recommendations
     recommendations = []
-    for tradition_key, score in sorted_scores:
-        if tradition_key in RELIGIONS:
-            tradition_info = RELIGIONS[tradition_key].copy()
-            tradition_info["score"] = score
-            
-            # Calculate percentage based on actual max possible
-            if max_possible_score > 0:
-                tradition_info["percentage"] = round((score / max_possible_score) * 100)
-            else:
-                tradition_info["percentage"] = 0
-            
-            recommendations.append(tradition_info)
-            
-            # Stop after top 3
-            if len(recommendations) == 3:
-                break
+    for col in ranked:
+        score = int(scores[col])
+        percentage = int(percentages[col])
+        
+        recommendations.append({
+            "name": RELIGION_NAMES[col],
+            "description": RELIGION_DESCRIPTIONS[col],
+            "practices": RELIGION_PRACTICES[col],
+            "core_beliefs": RELIGION_CORE_BELIEFS[col],
+            "score": score,
+            "percentage": percentage
+        })
     
     return recommendations
 
+# Rendered pages depend only on their inputs, the templates and the Firebase config,
+# so browsers can revalidate them by ETag and get a 304 without a re-render
+TEMPLATES_DIR = os.path.join(app.root_path, 'templates')
+PAGE_VERSION = hashlib.blake2b(orjson.dumps([
+    sorted((name, os.stat(os.path.join(TEMPLATES_DIR, name)).st_mtime_ns) for name in os.listdir(TEMPLATES_DIR)),
+    FIREBASE_CONFIG
+]), digest_size=8).hexdigest()
+
+def render_cached(etag_inputs, template, **context):
+    """Render template, or answer 304 if the client already has the page for etag_inputs"""
+    etag = hashlib.blake2b(
+        orjson.dumps([PAGE_VERSION, template, etag_inputs], default=ORJSONProvider.default),
+        digest_size=16
+    ).hexdigest()
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(render_template(template, **context), mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route("/")
 def landing():
-    return render_template('landing.html')
+    return render_cached(None, 'landing.html')
 
 @app.route("/assessment")
 def assessment():
-    # Check for Firebase user first, then legacy username
-    user_id = session.get('user_id')
-    username = session.get('username')
-    
-    if not user_id and not username:
+    store = get_store()
+    if not store:
         return redirect(url_for('login'))
     
-    # Get user data from appropriate source
-    if user_id:
-        # Firebase user
-        user_data = get_user_by_uid(user_id) or {}
-        display_name = session.get('email', 'User')
-        has_results = 'results' in user_data and user_data['results']
-    else:
-        # Legacy user
-        users = load_users()
-        user_data = users.get(username, {})
-        display_name = username
-        has_results = 'results' in user_data and user_data['results']
+    results = load_results(store)
+    save_error = pop_save_error(store)
+    display_name = store.display_name
+    has_results = bool(results)
     
-    return render_template(
+    return render_cached(
+        [display_name, results, save_error],
         "index.html", 
         title="Spiritual Path Finder", 
         message=f"Welcome, {display_name}!",
@@ -512,7 +1052,8 @@ def assessment():
         logged_in=True,
         questions=QUESTIONS,
         has_results=has_results,
-        results=user_data.get('results', []) if has_results else [],
+        results=results,
+        save_error=save_error,
         firebase_config=FIREBASE_CONFIG
     )
 
@@ -522,7 +1063,7 @@ def login():
         try:
             data = request.get_json()
             if not data:
-                return jsonify({"success": False, "message": "Invalid request"}), 400
+                return error_response("Invalid request", 400)
             
             # Firebase authentication - verify ID token from frontend
             id_token = data.get('idToken')
@@ -531,14 +1072,14 @@ def login():
                 # Firebase authentication flow
                 decoded_token = verify_firebase_token(id_token)
                 if not decoded_token:
-                    return jsonify({"success": False, "message": "Invalid authentication token"}), 401
+                    return error_response("Invalid authentication token", 401)
                 
                 uid = decoded_token['uid']
                 email = decoded_token.get('email', '')
                 
                 # Check if user exists in Firestore, create if not
-                user_data = get_user_by_uid(uid)
-                if not user_data:
+                user_data = get_user_fields(uid, ['email'])
+                if user_data is None:
                     # Create new user document
                     create_or_update_user(uid, {
                         'email': email,
@@ -554,46 +1095,39 @@ def login():
                 return jsonify({"success": True})
             else:
                 # Legacy username/password flow (backward compatibility)
+                if not LEGACY_USERS_ENABLED:
+                    return error_response(LEGACY_DISABLED_MESSAGE, 403)
+                
                 username = data.get('username', '').strip()
                 password = data.get('password', '')
                 
                 if not username or not password:
-                    return jsonify({"success": False, "message": "Username and password required"}), 400
-                
-                users = load_users()
-                if username not in users:
-                    return jsonify({"success": False, "message": "Invalid credentials"}), 401
+                    return error_response("Username and password required", 400)
                 
-                user_data = users[username]
+                user_data = get_legacy_user(username)
+                if not user_data:
+                    return error_response("Invalid credentials", 401)
                 
                 # Check if email is verified
                 if not user_data.get('verified', True):
-                    return jsonify({"success": False, "message": "Please verify your email first. Check your inbox."}), 403
-                
-                stored = user_data['password']
+                    return error_response("Please verify your email first. Check your inbox.", 403)
                 
-                # Try hash-based verification first
-                if stored.startswith(('scrypt:', 'pbkdf2:')):
-                    if check_password_hash(stored, password):
-                        session['username'] = username
-                        session.permanent = True
-                        return jsonify({"success": True})
-                # Legacy plaintext fallback
-                elif stored == password:
-                    users[username]['password'] = generate_password_hash(password)
-                    if not save_users(users):
-                        return jsonify({"success": False, "message": "Error saving data"}), 500
+                matches, needs_rehash = verify_password(user_data['password'], password)
+                if matches:
+                    # Upgrade plaintext/Werkzeug/outdated argon2 hashes in place
+                    if needs_rehash:
+                        update_legacy_user(username, password=hash_password(password))
                     session['username'] = username
                     session.permanent = True
                     return jsonify({"success": True})
                 
-                return jsonify({"success": False, "message": "Invalid credentials"}), 401
+                return error_response("Invalid credentials", 401)
         except Exception as e:
             print(f"Login error: {e}")
-            return jsonify({"success": False, "message": "Server error"}), 500
+            return error_response("Server error", 500)
     
     # Pass Firebase config to template
-    return render_template("index.html", logged_in=False, is_signup=False, firebase_config=FIREBASE_CONFIG)
+    return render_cached('login', "index.html", logged_in=False, is_signup=False, firebase_config=FIREBASE_CONFIG)
 
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
@@ -601,7 +1135,7 @@ def signup():
         try:
             data = request.get_json()
             if not data:
-                return jsonify({"success": False, "message": "Invalid request"}), 400
+                return error_response("Invalid request", 400)
             
             # Firebase authentication - verify ID token from frontend
             id_token = data.get('idToken')
@@ -610,7 +1144,7 @@ def signup():
                 # Firebase signup flow (user already created by Firebase Auth on frontend)
                 decoded_token = verify_firebase_token(id_token)
                 if not decoded_token:
-                    return jsonify({"success": False, "message": "Invalid authentication token"}), 401
+                    return error_response("Invalid authentication token", 401)
                 
                 uid = decoded_token['uid']
                 email = decoded_token.get('email', '')
@@ -632,55 +1166,52 @@ def signup():
                         "message": "Account created successfully!"
                     })
                 else:
-                    return jsonify({"success": False, "message": "Error creating user profile"}), 500
+                    return error_response("Error creating user profile", 500)
             else:
                 # Legacy username/password flow (backward compatibility)
+                if not LEGACY_USERS_ENABLED:
+                    return error_response(LEGACY_DISABLED_MESSAGE, 403)
+                
                 username = data.get('username', '').strip()
                 password = data.get('password', '')
                 email = data.get('email', '').strip().lower()
                 
                 if not username or not password:
-                    return jsonify({"success": False, "message": "Username and password required"}), 400
+                    return error_response("Username and password required", 400)
                 
                 if not email:
-                    return jsonify({"success": False, "message": "Email is required"}), 400
+                    return error_response("Email is required", 400)
                 
                 if not validate_email(email):
-                    return jsonify({"success": False, "message": "Invalid email format"}), 400
-                
-                users = load_users()
+                    return error_response("Invalid email format", 400)
                 
-                if username in users:
-                    return jsonify({"success": False, "message": "Username already exists"}), 409
+                if get_legacy_user(username):
+                    return error_response("Username already exists", 409)
                 
                 # Check if email already exists
-                for user_data in users.values():
-                    if user_data.get('email') == email:
-                        return jsonify({"success": False, "message": "Email already registered"}), 409
+                if find_username_by_email(email):
+                    return error_response("Email already registered", 409)
                 
                 # Generate verification token
-                token = secrets.token_urlsafe(32)
-                VERIFICATION_TOKENS[token] = {
+                token = make_token({
                     'username': username,
                     'email': email,
-                    'password': password,
-                    'timestamp': os.path.getmtime(USERS_FILE) if os.path.exists(USERS_FILE) else 0
-                }
+                    'type': 'email_verification'
+                })
                 
                 # Send verification email
                 send_verification_email(email, token)
                 
                 # Create user with verified status (auto-verify in dev mode)
-                users[username] = {
-                    'password': generate_password_hash(password),
+                created = add_legacy_user(username, {
+                    'password': hash_password(password),
                     'email': email,
                     'verified': True,  # Auto-verify in dev mode
                     'answers': [],
                     'results': []
-                }
-                
-                if not save_users(users):
-                    return jsonify({"success": False, "message": "Error saving user data"}), 500
+                })
+                if not created:
+                    return error_response("Username already exists", 409)
                     
                 return jsonify({
                     "success": True, 
@@ -689,10 +1220,10 @@ def signup():
                 })
         except Exception as e:
             print(f"Signup error: {e}")
-            return jsonify({"success": False, "message": "Server error"}), 500
+            return error_response("Server error", 500)
     
     # Pass Firebase config to template
-    return render_template("index.html", logged_in=False, is_signup=True, firebase_config=FIREBASE_CONFIG)
+    return render_cached('signup', "index.html", logged_in=False, is_signup=True, firebase_config=FIREBASE_CONFIG)
 
 @app.route("/forgot-password", methods=["GET", "POST"])
 def forgot_password():
@@ -700,24 +1231,21 @@ def forgot_password():
         try:
             data = request.get_json()
             if not data:
-                return jsonify({"success": False, "message": "Invalid request"}), 400
+                return error_response("Invalid request", 400)
+            
+            if not LEGACY_USERS_ENABLED:
+                return error_response(LEGACY_DISABLED_MESSAGE, 403)
                 
             email = data.get('email', '').strip().lower()
             
             if not email:
-                return jsonify({"success": False, "message": "Email is required"}), 400
+                return error_response("Email is required", 400)
             
             if not validate_email(email):
-                return jsonify({"success": False, "message": "Invalid email format"}), 400
-            
-            users = load_users()
+                return error_response("Invalid email format", 400)
             
             # Find user by email
-            user_found = None
-            for username, user_data in users.items():
-                if user_data.get('email') == email:
-                    user_found = username
-                    break
+            user_found = find_username_by_email(email)
             
             if not user_found:
                 # Don't reveal that email doesn't exist (security best practice)
@@ -727,13 +1255,12 @@ def forgot_password():
                 })
             
             # Generate reset token
-            token = secrets.token_urlsafe(32)
-            VERIFICATION_TOKENS[token] = {
+            token = make_token({
                 'username': user_found,
                 'email': email,
                 'type': 'password_reset',
-                'timestamp': os.path.getmtime(USERS_FILE) if os.path.exists(USERS_FILE) else 0
-            }
+                'pw': password_fingerprint(get_legacy_user(user_found)['password'])
+            })
             
             # Send reset email
             send_password_reset_email(email, token)
@@ -744,7 +1271,7 @@ def forgot_password():
             })
         except Exception as e:
             print(f"Password reset error: {e}")
-            return jsonify({"success": False, "message": "Server error"}), 500
+            return error_response("Server error", 500)
     
     return render_template("index.html", logged_in=False, is_signup=False, is_forgot_password=True)
 
@@ -752,17 +1279,16 @@ def forgot_password():
 def reset_password_page():
     """Handle password reset via token - show form to enter new password"""
     token = request.args.get('token')
-    if not token or token not in VERIFICATION_TOKENS:
+    token_data = load_token(token)
+    if not token_data:
         return render_template("index.html", logged_in=False, is_signup=False, 
                              reset_error="Invalid or expired reset token"), 400
     
-    token_data = VERIFICATION_TOKENS[token]
     if token_data.get('type') != 'password_reset':
         return render_template("index.html", logged_in=False, is_signup=False, 
                              reset_error="Invalid token type"), 400
     
-    # Store token in session temporarily for password reset form
-    session['reset_token'] = token
+    # The token travels in the reset form itself, so it is not kept in the session
     return render_template("index.html", logged_in=False, is_signup=False, 
                          show_reset_form=True, reset_token=token)
 
@@ -770,51 +1296,48 @@ def reset_password_page():
 def reset_password_submit():
     """Handle password reset submission"""
     try:
-        data = request.get_json()
+        data = request.get_json(cache=False)
         token = data.get('token')
         new_password = data.get('password', '')
         
-        if not token or token not in VERIFICATION_TOKENS:
-            return jsonify({"success": False, "message": "Invalid or expired token"}), 400
+        token_data = load_token(token)
+        if not token_data:
+            return error_response("Invalid or expired token", 400)
         
         if not new_password:
-            return jsonify({"success": False, "message": "Password is required"}), 400
+            return error_response("Password is required", 400)
         
-        token_data = VERIFICATION_TOKENS[token]
         if token_data.get('type') != 'password_reset':
-            return jsonify({"success": False, "message": "Invalid token type"}), 400
+            return error_response("Invalid token type", 400)
         
         # Reset password
-        users = load_users()
         username = token_data['username']
-        if username in users:
-            users[username]['password'] = generate_password_hash(new_password)
-            save_users(users)
-            del VERIFICATION_TOKENS[token]
-            session.pop('reset_token', None)
+        user_data = get_legacy_user(username)
+        if user_data:
+            # A token is single-use: it only matches the password it was issued for
+            if token_data.get('pw') != password_fingerprint(user_data['password']):
+                return error_response("Invalid or expired token", 400)
+            
+            update_legacy_user(username, password=hash_password(new_password))
             return jsonify({"success": True, "message": "Password reset successfully"})
         
-        return jsonify({"success": False, "message": "User not found"}), 404
+        return error_response("User not found", 404)
     except Exception as e:
         print(f"Password reset submit error: {e}")
-        return jsonify({"success": False, "message": "Server error"}), 500
+        return error_response("Server error", 500)
 
 @app.route("/verify-email")
 def verify_email():
     """Handle email verification"""
     token = request.args.get('token')
-    if not token or token not in VERIFICATION_TOKENS:
+    token_data = load_token(token)
+    if not token_data or token_data.get('type') != 'email_verification':
         return render_template("index.html", logged_in=False, is_signup=False, 
                              verify_error="Invalid or expired verification token"), 400
     
-    token_data = VERIFICATION_TOKENS[token]
-    users = load_users()
     username = token_data['username']
     
-    if username in users:
-        users[username]['verified'] = True
-        save_users(users)
-        del VERIFICATION_TOKENS[token]
+    if update_legacy_user(username, verified=True):
         return render_template("index.html", logged_in=False, is_signup=False, 
                              verify_success=True)
     
@@ -830,125 +1353,49 @@ def logout():
     return redirect(url_for('landing'))
 
 @app.route("/submit_assessment", methods=["POST"])
+@login_required
 def submit_assessment():
-    user_id = session.get('user_id')
-    username = session.get('username')
-    
-    if not user_id and not username:
-        return jsonify({"success": False, "message": "Not logged in"})
-    
-    data = request.json
+    data = request.get_json(cache=False)
     answers = data.get('answers', [])
     
     if len(answers) != len(QUESTIONS):
-        return jsonify({"success": False, "message": "Please answer all questions!"})
+        return error_response("Please answer all questions!")
     
     # Calculate results
     results = calculate_results(answers)
     
-    # Save to appropriate storage
-    if user_id:
-        # Firebase user - save to Firestore
-        user_ref = db.collection('users').document(user_id)
-        user_ref.update({
-            'answers': answers,
-            'results': results,
-            'updated_at': firestore.SERVER_TIMESTAMP
-        })
+    # Persisted in the background when possible; the user sees results without waiting on the write
+    if save_assessment(g.store, answers, results):
         return jsonify({"success": True, "results": results})
-    else:
-        # Legacy user - save to JSON
-        users = load_users()
-        if username in users:
-            users[username]['answers'] = answers
-            users[username]['results'] = results
-            save_users(users)
-            return jsonify({"success": True, "results": results})
     
-    return jsonify({"success": False, "message": "User not found"})
+    return error_response("User not found")
 
 @app.route("/reset_assessment", methods=["POST"])
+@login_required
 def reset_assessment():
-    user_id = session.get('user_id')
-    username = session.get('username')
-    
-    if not user_id and not username:
-        return jsonify({"success": False, "message": "Not logged in"})
-    
-    # Reset in appropriate storage
-    if user_id:
-        # Firebase user - reset in Firestore
-        user_ref = db.collection('users').document(user_id)
-        user_ref.update({
-            'answers': [],
-            'results': [],
-            'updated_at': firestore.SERVER_TIMESTAMP
-        })
+    # Goes through the same path as submit so it cannot overtake an earlier save
+    if save_assessment(g.store, [], []):
         return jsonify({"success": True})
-    else:
-        # Legacy user - reset in JSON
-        users = load_users()
-        if username in users:
-            users[username]['answers'] = []
-            users[username]['results'] = []
-            save_users(users)
-            return jsonify({"success": True})
     
-    return jsonify({"success": False, "message": "User not found"})
+    return error_response("User not found")
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    """
-    RAG-enhanced chat endpoint for spiritual guidance
-    Uses retrieval-augmented generation with religion-specific context
-    """
-    if 'user_id' not in session and 'username' not in session:
-        return jsonify({"success": False, "message": "Not logged in"})
-    
-    if not client:
-        return jsonify({"success": False, "message": "Chat service not configured. Please set TOGETHER_API_KEY."})
-    
-    data = request.json
-    user_message = data.get('message', '').strip()
-    religion_name = data.get('religion', '')
-    chat_history = data.get('history', [])
-    
-    if not user_message or not religion_name:
-        return jsonify({"success": False, "message": "Message and religion required"})
-    
-    # Find religion in CSV data first, fallback to basic RELIGIONS
-    religion_data = None
-    religion_key = None
-    
-    for key, value in RELIGIONS.items():
-        if value['name'] == religion_name:
-            religion_key = key
-            # Use CSV data if available
-            if key in RELIGIONS_CSV:
-                religion_data = RELIGIONS_CSV[key]
-            else:
-                religion_data = value
-            break
-    
-    if not religion_data:
-        return jsonify({"success": False, "message": "Religion not found"})
-    
-    # Build RAG context using rag_utils
-    if religion_key in RELIGIONS_CSV:
-        # Rich context from CSV using RAG utilities
-        csv_data = RELIGIONS_CSV[religion_key]
-        context_chunks = prepare_religion_rag_context(csv_data)
-        context = f"""REFERENCE DATA FOR {csv_data['name']}:
+# Server-side caps on chat input and on the history kept per conversation
+CHAT_HISTORY_TURNS = 4
+CHAT_HISTORY_MAX_CHARS = 4000
+CHAT_MESSAGE_MAX_CHARS = 2000
+CHAT_CONVERSATION_ID_MAX_CHARS = 64
 
-{context_chunks[0]}"""
-    else:
-        # Fallback to basic data
-        basic_context = prepare_religion_rag_context(religion_data)
-        context = f"""REFERENCE DATA FOR {religion_data['name']}:
+def build_system_prompt(religion_key):
+    """Build the RAG system prompt for one tradition from CSV data, falling back to RELIGIONS"""
+    religion_data = RELIGIONS[religion_key]
+    context_chunks = prepare_religion_rag_context(RELIGIONS_CSV.get(religion_key, religion_data))
+    if not context_chunks[0]:
+        context_chunks = prepare_religion_rag_context(religion_data)
+    context = f"""REFERENCE DATA FOR {religion_data['name']}:
 
-{basic_context[0]}"""
+{context_chunks[0]}"""
     
-    system_prompt = f"""You're a knowledgeable spiritual guide. Use the reference data below to answer questions.
+    return f"""You're a knowledgeable spiritual guide. Use the reference data below to answer questions.
 
 {context}
 
@@ -961,98 +1408,215 @@ INSTRUCTIONS:
 - End responses with complete thoughts, not incomplete phrases
 - If you need to cut information, end with "..." but complete the current sentence"""
 
-    # Build conversation
-    messages = [{"role": "system", "content": system_prompt}]
+# Reference data is static, so every tradition's system prompt is built once at startup,
+# keyed by the display name the chat UI sends
+SYSTEM_PROMPTS = {value['name']: build_system_prompt(key) for key, value in RELIGIONS.items()}
+
+# Identical conversations (same model, prompt and history) reuse the earlier reply
+CHAT_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct-Lite"
+CHAT_CACHE_TTL_SECONDS = 86400
+_chat_cache = TTLCache(maxsize=4096, ttl=CHAT_CACHE_TTL_SECONDS)
+_chat_cache_lock = threading.Lock()
+
+def chat_cache_key(messages):
+    """Hash the model id and conversation into a compact cache key"""
+    payload = orjson.dumps([CHAT_MODEL, messages])
+    return 'chat:' + hashlib.sha256(payload).hexdigest()
+
+def get_cached_reply(key):
+    """Return a cached chat reply, or None"""
+    if redis_client:
+        cached = redis_client.get(key)
+        return cached.decode() if cached is not None else None
+    with _chat_cache_lock:
+        return _chat_cache.get(key)
+
+def store_cached_reply(key, reply):
+    """Cache a complete chat reply"""
+    if redis_client:
+        redis_client.setex(key, CHAT_CACHE_TTL_SECONDS, reply)
+    else:
+        with _chat_cache_lock:
+            _chat_cache[key] = reply
+
+def stream_chat_completion(messages):
+    """Yield the model's reply for messages in pieces as Together generates it.
+    A cached reply is yielded whole; a reply is only cached once fully received."""
+    key = chat_cache_key(messages)
+    cached = get_cached_reply(key)
+    if cached is not None:
+        yield cached
+        return
     
-    # Add recent chat history
-    for msg in chat_history[-4:]:
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    parts = []
+    with get_chat_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=400,
+        temperature=0.7,
+        stream=True,
+    ) as stream:
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
     
-    messages.append({"role": "user", "content": user_message})
+    store_cached_reply(key, ''.join(parts))
+
+def sse_event(data):
+    """Format one server-sent event carrying a JSON payload"""
+    return b'data: ' + orjson.dumps(data) + b'\n\n'
+
+@app.route("/chat", methods=["POST"])
+@login_required
+def chat():
+    """
+    RAG-enhanced chat endpoint for spiritual guidance
+    Uses retrieval-augmented generation with religion-specific context
+    and streams the reply back as server-sent events
+    """
+    if not get_chat_client():
+        return error_response("Chat service not configured. Please set TOGETHER_API_KEY.")
+    
+    data = request.get_json(cache=False)
+    user_message = data.get('message', '').strip()[:CHAT_MESSAGE_MAX_CHARS]
+    religion_name = data.get('religion', '')
+    conversation = data.get('conversation', '')
+    if not isinstance(conversation, str) or len(conversation) > CHAT_CONVERSATION_ID_MAX_CHARS:
+        conversation = ''
+    
+    if not user_message or not religion_name:
+        return error_response("Message and religion required")
+    
+    system_prompt = SYSTEM_PROMPTS.get(religion_name) if isinstance(religion_name, str) else None
+    if not system_prompt:
+        return error_response("Religion not found")
+
+    # Recent turns live server-side, per user, tradition and browser conversation
+    history_key = f"chat_history:{g.store.user_key}:{religion_name}:{conversation}"
+    chat_history = state_get(history_key) or []
     
+    # Collapse whitespace so trivially different phrasings share a cache entry
+    user_turn = {"role": "user", "content": ' '.join(user_message.split())}
+    messages = [{"role": "system", "content": system_prompt}, *chat_history, user_turn]
+    
+    # Stream the reply as server-sent events: {"delta": ...} pieces, then {"done": true}
+    def events():
+        try:
+            parts = []
+            for delta in stream_chat_completion(messages):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            # Keep only the last CHAT_HISTORY_TURNS messages, each truncated
+            bot_turn = {"role": "assistant", "content": ''.join(parts)[:CHAT_HISTORY_MAX_CHARS]}
+            state_set(history_key, [*chat_history, user_turn, bot_turn][-CHAT_HISTORY_TURNS:])
+            yield sse_event({"done": True})
+        except Exception as e:
+            yield sse_event({"error": f"Chat error: {str(e)}"})
+    
+    return app.response_class(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def run_transcription(task_id, owner, audio):
+    """Background job: transcribe audio with Whisper and record the outcome"""
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/Meta-Llama-3-8B-Instruct-Lite",
-            messages=messages,
-            max_tokens=400,
-            temperature=0.7,
-        )
-        
-        bot_response = response.choices[0].message.content
-        
-        return jsonify({
-            "success": True,
-            "response": bot_response
-        })
-        
+        with audio:
+            transcript = get_openai_client().audio.transcriptions.create(
+                model="whisper-1",
+                file=("recording.webm", audio, "audio/webm")
+            )
+        state_set(f'transcription:{task_id}', {'owner': owner, 'status': 'done', 'text': transcript.text})
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "message": f"Chat error: {str(e)}"
-        })
+        print(f"Transcription error: {e}")
+        state_set(f'transcription:{task_id}', {'owner': owner, 'status': 'error', 'message': str(e)})
 
 @app.route("/transcribe", methods=["POST"])
+@login_required
 def transcribe():
-    """Convert audio to text using Whisper"""
-    if 'username' not in session:
-        return jsonify({"success": False, "message": "Not logged in"})
-    
-    if not openai_client:
-        return jsonify({"success": False, "message": "Whisper not configured"})
+    """Queue audio for Whisper transcription and return a task id to poll"""
+    if not get_openai_client():
+        return error_response("Whisper not configured")
     
     audio_file = request.files.get('audio')
     if not audio_file:
-        return jsonify({"success": False, "message": "No audio file"})
+        return error_response("No audio file")
     
     try:
-        # Convert FileStorage to bytes
-        audio_bytes = audio_file.read()
+        # Copy the upload out of the request stream (it is gone once we return);
+        # small clips stay in memory, larger ones spill to disk
+        audio = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+        shutil.copyfileobj(audio_file.stream, audio)
+        audio.seek(0)
         
-        transcript = openai_client.audio.transcriptions.create(
-            model="whisper-1",
-            file=("recording.webm", audio_bytes, "audio/webm")
-        )
-        return jsonify({"success": True, "text": transcript.text})
+        task_id = secrets.token_urlsafe(16)
+        owner = g.store.user_key
+        state_set(f'transcription:{task_id}', {'owner': owner, 'status': 'pending'})
+        transcription_executor.submit(run_transcription, task_id, owner, audio)
+        return jsonify({"success": True, "task_id": task_id})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
-@app.route("/debug")
-def debug():
-    """
-    Debug endpoint to check API configuration and environment
-    """
-    return jsonify({
-        "api_key_set": bool(TOGETHER_API_KEY),
-        "client_available": client is not None,
-        "environment": os.environ.get("ENVIRONMENT", "unknown"),
-        "together_api_key_length": len(TOGETHER_API_KEY) if TOGETHER_API_KEY else 0,
-        "flask_debug": app.debug,
-        "users_file": USERS_FILE
-    })
-
-@app.route("/session-debug")
-def session_debug():
-    """
-    Debug endpoint to check session and user data
-    """
-    users = load_users()
-    return jsonify({
-        "session_data": dict(session),
-        "username_in_session": 'username' in session,
-        "current_username": session.get('username', 'None'),
-        "users_file_exists": os.path.exists(USERS_FILE),
-        "users_file_path": os.path.abspath(USERS_FILE),
-        "users_count": len(users),
-        "user_list": list(users.keys()),
-        "session_cookie_config": {
-            "secure": app.config.get('SESSION_COOKIE_SECURE'),
-            "httponly": app.config.get('SESSION_COOKIE_HTTPONLY'),
-            "samesite": app.config.get('SESSION_COOKIE_SAMESITE')
-        }
-    })
+@app.route("/transcription/<task_id>")
+@login_required
+def transcription_status(task_id):
+    """Poll the status of a queued transcription"""
+    job = state_get(f'transcription:{task_id}')
+    if not job or job.get('owner') != g.store.user_key:
+        return error_response("Transcription not found", 404)
+    
+    if job['status'] == 'pending':
+        return jsonify({"success": True, "status": "pending"})
+    if job['status'] == 'error':
+        return jsonify({"success": False, "status": "error", "message": job['message']})
+    
+    state_delete(f'transcription:{task_id}')
+    return jsonify({"success": True, "status": "done", "text": job['text']})
+
+# Diagnostic endpoints expose configuration, so they only exist when explicitly enabled
+if ENABLE_DEBUG_ROUTES:
+    @app.route("/debug")
+    def debug():
+        """
+        Debug endpoint to check API configuration and environment
+        """
+        return jsonify({
+            "api_key_set": bool(TOGETHER_API_KEY),
+            "client_available": get_chat_client() is not None,
+            "environment": ENVIRONMENT,
+            "together_api_key_length": len(TOGETHER_API_KEY) if TOGETHER_API_KEY else 0,
+            "flask_debug": app.debug,
+            "legacy_users_enabled": LEGACY_USERS_ENABLED,
+            "users_db": USERS_DB
+        })
+
+    @app.route("/session-debug")
+    def session_debug():
+        """
+        Debug endpoint to check session and user data
+        """
+        usernames = list_legacy_usernames() if LEGACY_USERS_ENABLED else []
+        return jsonify({
+            "session_data": dict(session),
+            "username_in_session": 'username' in session,
+            "current_username": session.get('username', 'None'),
+            "users_db_exists": os.path.exists(USERS_DB),
+            "users_db_path": os.path.abspath(USERS_DB),
+            "users_count": len(usernames),
+            "user_list": usernames,
+            "session_cookie_config": {
+                "secure": app.config.get('SESSION_COOKIE_SECURE'),
+                "httponly": app.config.get('SESSION_COOKIE_HTTPONLY'),
+                "samesite": app.config.get('SESSION_COOKIE_SAMESITE')
+            }
+        })
 
 # Initialize default test user on startup
-initialize_default_user()
+if LEGACY_USERS_ENABLED:
+    initialize_default_user()
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5003)
\ No newline at end of file
+    app.run(debug=FLASK_ENV == "development", port=5003)
\ No newline at end of file
@@ -0,0 +1,25 @@
+"""
+Gunicorn settings for the Spiritual Path Assessment app.
+Routes spend most of their time waiting on Firestore, Together and OpenAI,
+so gevent workers let one process overlap many requests while they wait.
+Set GUNICORN_WORKER_CLASS=gthread to fall back to threaded workers.
+"""
+import os
+
+bind = "0.0.0.0:5003"
+
+# Transcription jobs, chat history, the user cache and background saves are
+# only shared between worker processes through Redis, so fan out to
+# 2*CPU+1 workers only when it is set
+_redis_url = os.getenv("REDIS_URL")
+_default_workers = 2 * (os.cpu_count() or 1) + 1 if _redis_url else 1
+workers = int(os.getenv("GUNICORN_WORKERS", _default_workers))
+if workers > 1 and not _redis_url:
+    raise RuntimeError("GUNICORN_WORKERS > 1 requires REDIS_URL (worker state is process-local without Redis)")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+if worker_class == "gthread":
+    threads = int(os.getenv("GUNICORN_THREADS", "32"))
+else:
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = 60
+keepalive = 5
@@ -463,7 +463,8 @@ function getResultsSummary() {
 
 // ==================== CHAT FUNCTIONALITY ====================
 
-var chatHistories = {};
+// One conversation id per tradition per page load; the server keeps the history
+var chatConversations = {};
 
 function formatBotResponse(text) {
     var div = document.createElement('div');
@@ -514,9 +515,9 @@ function sendMessage(religionName) {
     var message = inputEl.value.trim();
     if (!message) return;
     
-    // Initialize chat history if not exists
-    if (!chatHistories[religionName]) {
-        chatHistories[religionName] = [];
+    // Start a new server-side conversation on first message
+    if (!chatConversations[religionName]) {
+        chatConversations[religionName] = Date.now().toString(36) + Math.random().toString(36).slice(2);
     }
     
     // Add user message to UI
@@ -538,65 +539,98 @@ function sendMessage(religionName) {
     // Scroll to bottom
     messagesEl.scrollTop = messagesEl.scrollHeight;
     
-    // Add to chat history
-    chatHistories[religionName].push({
-        role: 'user',
-        content: message
-    });
-    
-    // Send to backend
+    // Send to backend; replies stream back as server-sent events
     fetch('/chat', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
         body: JSON.stringify({
             message: message,
             religion: religionName,
-            history: chatHistories[religionName]
+            conversation: chatConversations[religionName]
         })
     })
-    .then(function(response) { return response.json(); })
-    .then(function(data) {
-        messagesEl.removeChild(typingDiv);
+    .then(function(response) {
+        var contentType = response.headers.get('Content-Type') || '';
         
-        if (data.success) {
-            var botMsgDiv = document.createElement('div');
-            botMsgDiv.className = 'chat-message bot';
-            
-            // Format the response with proper bullet points
-            var formattedResponse = formatBotResponse(data.response);
-            botMsgDiv.innerHTML = formattedResponse;
-            
-            messagesEl.appendChild(botMsgDiv);
-            
-            chatHistories[religionName].push({
-                role: 'assistant',
-                content: data.response
+        // Requests rejected up front come back as plain JSON errors
+        if (contentType.indexOf('text/event-stream') === -1) {
+            return response.json().then(function(data) {
+                removeTypingIndicator(typingDiv);
+                appendChatError(messagesEl, data.message);
             });
-        } else {
-            var errorMsgDiv = document.createElement('div');
-            errorMsgDiv.className = 'chat-message bot';
-            errorMsgDiv.style.color = '#EF4444';
-            errorMsgDiv.textContent = '❌ ' + data.message;
-            messagesEl.appendChild(errorMsgDiv);
         }
         
-        sendBtn.disabled = false;
-        messagesEl.scrollTop = messagesEl.scrollHeight;
+        var botMsgDiv = null;
+        var botResponse = '';
+        
+        return readEventStream(response, function(event) {
+            if (event.error) {
+                removeTypingIndicator(typingDiv);
+                appendChatError(messagesEl, event.error);
+            } else if (event.delta) {
+                if (!botMsgDiv) {
+                    removeTypingIndicator(typingDiv);
+                    botMsgDiv = document.createElement('div');
+                    botMsgDiv.className = 'chat-message bot';
+                    messagesEl.appendChild(botMsgDiv);
+                }
+                botResponse += event.delta;
+                
+                // Format the response with proper bullet points
+                botMsgDiv.innerHTML = formatBotResponse(botResponse);
+                messagesEl.scrollTop = messagesEl.scrollHeight;
+            }
+        }).then(function() {
+            removeTypingIndicator(typingDiv);
+        });
     })
     .catch(function(error) {
-        messagesEl.removeChild(typingDiv);
-        
-        var errorMsgDiv = document.createElement('div');
-        errorMsgDiv.className = 'chat-message bot';
-        errorMsgDiv.style.color = '#EF4444';
-        errorMsgDiv.textContent = '❌ Connection error';
-        messagesEl.appendChild(errorMsgDiv);
-        
+        removeTypingIndicator(typingDiv);
+        appendChatError(messagesEl, 'Connection error');
+    })
+    .then(function() {
         sendBtn.disabled = false;
         messagesEl.scrollTop = messagesEl.scrollHeight;
     });
 }
 
+function readEventStream(response, onEvent) {
+    // Parse "data: {...}" server-sent events from a fetch response body
+    var reader = response.body.getReader();
+    var decoder = new TextDecoder();
+    var buffer = '';
+    
+    function pump() {
+        return reader.read().then(function(result) {
+            if (result.done) return;
+            buffer += decoder.decode(result.value, {stream: true});
+            var events = buffer.split('\n\n');
+            buffer = events.pop();
+            events.forEach(function(event) {
+                if (event.indexOf('data: ') === 0) {
+                    onEvent(JSON.parse(event.slice(6)));
+                }
+            });
+            return pump();
+        });
+    }
+    return pump();
+}
+
+function removeTypingIndicator(typingDiv) {
+    if (typingDiv.parentNode) {
+        typingDiv.parentNode.removeChild(typingDiv);
+    }
+}
+
+function appendChatError(messagesEl, text) {
+    var errorMsgDiv = document.createElement('div');
+    errorMsgDiv.className = 'chat-message bot';
+    errorMsgDiv.style.color = '#EF4444';
+    errorMsgDiv.textContent = '❌ ' + text;
+    messagesEl.appendChild(errorMsgDiv);
+}
+
 // ==================== VOICE CHAT ====================
 
 var recognition = null;
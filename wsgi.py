@@ -0,0 +1,17 @@
+"""
+WSGI entry point for gunicorn (see gunicorn.conf.py).
+Under gevent workers the standard library and gRPC (used by Firestore) are
+patched for cooperative I/O before the app and its clients are imported.
+"""
+import os
+
+if os.getenv("GUNICORN_WORKER_CLASS", "gevent") == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
+from app import app  # noqa: E402,F401
+
+__all__ = ["app"]